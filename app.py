@@ -10,9 +10,12 @@ from sqlalchemy.sql.expression import func
 from sqlalchemy.types import Numeric  
 from flask_cors import CORS
 import requests
-import subprocess
 import random
 from secrets_manager import get_service_secrets
+import metrics
+import request_logging
+import profiling
+import background
 from base64 import b64encode, b64decode
 import json
 from datetime import datetime
@@ -45,23 +48,38 @@ ns = api.namespace('api/convos', description='Conversation operations')
 # Add this after Api initialization
 @api.representation('application/json')
 def output_json(data, code, headers=None):
-    resp = app.make_response(json.dumps(data, cls=CustomJSONEncoder))
+    resp = app.make_response((json.dumps(data, cls=CustomJSONEncoder), code))
     resp.headers.extend(headers or {})
     return resp
 
-secrets = get_service_secrets('gnosis-convos')
+# With these set as GNOSIS_CONVOS_* env vars the service starts without touching AWS
+REQUIRED_SECRETS = ('API_KEY', 'INFLUENCER_API_URL', 'PROFILES_API_URL', 'CONTENT_PROCESSOR_API_URL') + (
+    ('DATABASE_URL',) if 'GNOSIS_CONVOS_DATABASE_URL' in os.environ
+    else ('MYSQL_USER', 'MYSQL_PASSWORD_CONVOS', 'MYSQL_HOST', 'MYSQL_PORT', 'MYSQL_DATABASE')
+)
+secrets = get_service_secrets('gnosis-convos', required=REQUIRED_SECRETS)
 
-# Set up the Influencer API URL
-INFLUENCER_API_URL = secrets.get('INFLUENCER_API_URL')
-PROFILES_API_URL = secrets.get('PROFILES_API_URL')
-CONTENT_PROCESSOR_API_URL = secrets.get('CONTENT_PROCESSOR_API_URL')
-CONVERSATION_API_URL = secrets.get('CONVERSATION_API_URL', 'http://localhost:5000')
-API_KEY = secrets.get('API_KEY')
+def live_secret(key, default=None):
+    """Read a secret that can rotate while we run (API key, downstream URLs); re-checked once per TTL"""
+    return get_service_secrets('gnosis-convos', required=REQUIRED_SECRETS).get(key, default)
 
 C_PORT = int(secrets.get('PORT', 5000))
 
-# Database configuration
-SQLALCHEMY_DATABASE_URI = (
+# Request logging: fraction of requests whose headers/body are logged, and body cap
+LOG_LEVEL = secrets.get('LOG_LEVEL', 'INFO')
+LOG_SAMPLE_RATE = float(secrets.get('LOG_SAMPLE_RATE', 0.01))
+LOG_BODY_MAX_BYTES = int(secrets.get('LOG_BODY_MAX_BYTES', 256))
+
+# On-demand profiling: disabled unless a token or sample rate is set
+PROFILE_DIR = secrets.get('PROFILE_DIR', '/tmp/convos-profiles')
+PROFILE_TOKEN = secrets.get('PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = float(secrets.get('PROFILE_SAMPLE_RATE', 0.0))
+
+# Threads for fire-and-forget calls back into this service (batch, shuffle)
+BACKGROUND_WORKERS = int(secrets.get('BACKGROUND_WORKERS', 4))
+
+# Database configuration (DATABASE_URL overrides MySQL, e.g. sqlite for local benchmarks)
+SQLALCHEMY_DATABASE_URI = secrets.get('DATABASE_URL') or (
     f"mysql+pymysql://{secrets['MYSQL_USER']}:{secrets['MYSQL_PASSWORD_CONVOS']}"
     f"@{secrets['MYSQL_HOST']}:{secrets['MYSQL_PORT']}/{secrets['MYSQL_DATABASE']}"
 )
@@ -70,8 +88,19 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db = SQLAlchemy(app)
 
+with app.app_context():
+    metrics.init_app(app, db.engine)
+
 # Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+request_logging.configure_logging(level=LOG_LEVEL)
+request_logging.init_app(
+    app,
+    sample_rate=LOG_SAMPLE_RATE,
+    body_max_bytes=LOG_BODY_MAX_BYTES,
+    skip_paths=('/docs', '/swagger', metrics.METRICS_PATH)
+)
+profiling.init_app(app, PROFILE_DIR, token=PROFILE_TOKEN, sample_rate=PROFILE_SAMPLE_RATE)
+background.configure(BACKGROUND_WORKERS)
 
 class SenderType(Enum):
     user = 'user'
@@ -216,6 +245,46 @@ class Message(db.Model):
             'timestamp': self.timestamp
         }
 
+def run_in_background(fn, *args, **kwargs):
+    """Run fn on the background pool inside an app context, so shutdown can drain it"""
+    def task():
+        with app.app_context():
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                db.session.rollback()
+                raise
+    background.submit(task)
+
+def create_conversation(user_id, content_id, content_chunk_id=None, correlation_id=None):
+    """Create a conversation and nudge the influencer to write the first AI message"""
+    conversation = Conversation(
+        user_id=user_id, 
+        content_id=content_id
+    )
+    conversation.update_score(randomness_factor=0.2)
+
+    db.session.add(conversation)
+    db.session.flush()
+    db.session.commit()
+
+    headers = {'X-API-KEY': live_secret('API_KEY')}
+    if correlation_id:
+        headers['X-Correlation-ID'] = correlation_id
+
+    with metrics.downstream('influencer'):
+        influencer_response = requests.post(
+            f"{live_secret('INFLUENCER_API_URL')}/api/message/ai",
+            json={'conversation_id': conversation.id, 'content_chunk_id': content_chunk_id},
+            headers=headers
+        )
+
+    if influencer_response.status_code not in [200, 202]:
+        logging.warning(f"gnosis-influencer responded with status code {influencer_response.status_code}")
+
+    logging.info(f"Conversation created successfully with ID: {conversation.id}")
+    return conversation
+
 def add_links(response_data, endpoint, **params):
     """Add HATEOAS links to response"""
     base_url = "/api/convos"
@@ -268,31 +337,12 @@ class ConversationListResource(Resource):
             return {"error": "user_id and content_id are required"}, 400
 
         try:
-            conversation = Conversation(
-                user_id=user_id, 
-                content_id=content_id
-            )
-            conversation.update_score(randomness_factor=0.2)
-
-            db.session.add(conversation)
-            db.session.flush()
-            db.session.commit()
-
-            headers = {'X-API-KEY': API_KEY}
-            correlation_id = request.headers.get('X-Correlation-ID')
-            if correlation_id:
-                headers['X-Correlation-ID'] = correlation_id
-
-            influencer_response = requests.post(
-                f"{INFLUENCER_API_URL}/api/message/ai",
-                json={'conversation_id': conversation.id, 'content_chunk_id': content_chunk_id},
-                headers=headers
+            conversation = create_conversation(
+                user_id,
+                content_id,
+                content_chunk_id,
+                request.headers.get('X-Correlation-ID')
             )
-
-            if influencer_response.status_code not in [200, 202]:
-                logging.warning(f"gnosis-influencer responded with status code {influencer_response.status_code}")
-
-            logging.info(f"Conversation created successfully with ID: {conversation.id}")
             response_data = {
                 'message': 'Conversation created successfully',
                 'conversation_id': conversation.id
@@ -340,10 +390,11 @@ class ConversationListResource(Resource):
             
             for conv in conversations:
                 if conv.content_id not in ai_profile_cache:
-                    ai_response = requests.get(
-                        f"{PROFILES_API_URL}/api/ais/content/{conv.content_id}",
-                        headers={'X-API-KEY': API_KEY}
-                    )
+                    with metrics.downstream('profiles'):
+                        ai_response = requests.get(
+                            f"{live_secret('PROFILES_API_URL')}/api/ais/content/{conv.content_id}",
+                            headers={'X-API-KEY': live_secret('API_KEY')}
+                        )
                     ai_profile = {}
                     if ai_response.status_code == 200:
                         ai_data = ai_response.json()
@@ -362,11 +413,12 @@ class ConversationListResource(Resource):
                 next_cursor = encode_cursor(conversations[-1].cursor_value)
 
             if refresh and not cursor:
-                requests.post(
-                    f"{CONVERSATION_API_URL}/api/convos/batch", 
-                    json={'user_id': user_id, 'num_convos': 5},
-                    headers={'X-API-KEY': API_KEY}
-                )
+                with metrics.downstream('convos'):
+                    requests.post(
+                        f"{live_secret('CONVERSATION_API_URL', 'http://localhost:5000')}/api/convos/batch", 
+                        json={'user_id': user_id, 'num_convos': 5},
+                        headers={'X-API-KEY': live_secret('API_KEY')}
+                    )
 
             response_data = {
                 "conversations": conversation_data,
@@ -392,33 +444,34 @@ class BatchConversationResource(Resource):
         num_convos = request.json.get('num_convos', 10)
 
         try:
-            headers = {'X-API-KEY': API_KEY}
+            headers = {'X-API-KEY': live_secret('API_KEY')}
             correlation_id = request.headers.get('X-Correlation-ID')
             if correlation_id:
                 headers['X-Correlation-ID'] = correlation_id
 
-            content_ids = requests.get(
-                f"{CONTENT_PROCESSOR_API_URL}/api/content_ids?user_id={user_id}",
-                headers=headers
-            ).json()
+            with metrics.downstream('content_processor'):
+                content_ids = requests.get(
+                    f"{live_secret('CONTENT_PROCESSOR_API_URL')}/api/content_ids?user_id={user_id}",
+                    headers=headers
+                ).json()
 
             if not content_ids:
                 logging.warning(f"No content found for user_id: {user_id}")
                 return {"error": "No content found for user"}, 404
 
 
-            logging.info(f"Content IDs: {content_ids}")
             content_ids = content_ids.get('content_ids', [])
+            logging.info(f"Found {len(content_ids)} content IDs for user_id: {user_id}")
             content_chunks = []
             for content_id in content_ids:
-                logging.info(f"Getting chunks for content_id: {content_id}")
-                logging.info(f"Headers: {headers}")
-                logging.info(f"URL: {CONTENT_PROCESSOR_API_URL}/api/content/{content_id}/chunks")
-                chunks_response = requests.get(
-                    f"{CONTENT_PROCESSOR_API_URL}/api/content/{content_id}/chunks",
-                    headers=headers
-                )
-                logging.info(f"Chunks response: {chunks_response.status_code} - {chunks_response.text}")
+                logging.debug("Getting chunks for content_id: %s", content_id)
+                with metrics.downstream('content_processor'):
+                    chunks_response = requests.get(
+                        f"{live_secret('CONTENT_PROCESSOR_API_URL')}/api/content/{content_id}/chunks",
+                        headers=headers
+                    )
+                logging.debug("Chunks response for content_id %s: %s (%d bytes)",
+                              content_id, chunks_response.status_code, len(chunks_response.content))
                 if chunks_response.status_code == 200:
                     chunks = chunks_response.json().get('chunks', [])
                     content_chunks.extend([{
@@ -440,20 +493,10 @@ class BatchConversationResource(Resource):
                 return {"error": "No available chunks found for user"}, 404
 
             selected_chunks = random.sample(available_chunks, min(num_convos, len(available_chunks)))
-            logging.info(f"Selected chunks: {selected_chunks}")
+            logging.info(f"Selected {len(selected_chunks)} chunks for user_id: {user_id}")
 
             for chunk in selected_chunks:
-                subprocess.Popen([
-                    'python', '-c',
-                    f"import requests; "
-                    f"requests.post('{CONVERSATION_API_URL}/api/convos', "
-                    f"json={{"
-                    f"'user_id': {user_id}, "
-                    f"'content_id': {chunk['content_id']}, "
-                    f"'content_chunk_id': {chunk['chunk_id']}"
-                    f"}}, "
-                    f"headers={{'X-API-KEY': '{API_KEY}'}})"
-                ])
+                run_in_background(create_conversation, user_id, chunk['content_id'], chunk['chunk_id'], correlation_id)
 
             logging.info(f"Batch conversation creation initiated for user_id: {user_id}")
             return {"message": "Request received"}, 202
@@ -528,16 +571,17 @@ class ConversationReplyResource(Resource):
             conversation.update_score(randomness_factor=0.05)
             db.session.commit()
 
-            headers = {'X-API-KEY': API_KEY}
+            headers = {'X-API-KEY': live_secret('API_KEY')}
             correlation_id = request.headers.get('X-Correlation-ID')
             if correlation_id:
                 headers['X-Correlation-ID'] = correlation_id
 
-            influencer_response = requests.post(
-                f"{INFLUENCER_API_URL}/api/message/ai",
-                json={'conversation_id': conversation_id},
-                headers=headers
-            )
+            with metrics.downstream('influencer'):
+                influencer_response = requests.post(
+                    f"{live_secret('INFLUENCER_API_URL')}/api/message/ai",
+                    json={'conversation_id': conversation_id},
+                    headers=headers
+                )
 
             logging.info(f"Nudged influencer with status code: {influencer_response.status_code}")
 
@@ -564,13 +608,7 @@ class ShuffleResource(Resource):
         user_id = request.json['user_id']
         volatility = request.json.get('volatility', 0.5)
 
-        subprocess.Popen([
-            'python', '-c',
-            f"import requests; "
-            f"requests.post('{CONVERSATION_API_URL}/api/convos/shuffle-helper', "
-            f"json={{'user_id': {user_id}, 'volatility': {volatility}}}, "
-            f"headers={{'X-API-KEY': '{API_KEY}'}})"
-        ])
+        run_in_background(Conversation.shuffle_scores, user_id, volatility)
 
         return {"message": "Shuffle initiated"}, 202
 
@@ -594,13 +632,12 @@ class ShuffleHelperResource(Resource):
 
 # add middleware
 @app.before_request
-def log_request_info():
-    # Exempt the /docs endpoint from logging and API key checks
+def check_api_key():
+    # Exempt the /docs and /metrics endpoints from API key checks
     if request.path.startswith('/docs') or request.path.startswith('/swagger'):
         return
-
-    logging.info(f"Headers: {request.headers}")
-    logging.info(f"Body: {request.get_data()}")
+    if request.path == metrics.METRICS_PATH:
+        return
 
     # for now just check that it has a Authorization header
     if 'X-API-KEY' not in request.headers:
@@ -608,7 +645,7 @@ def log_request_info():
         return {"error": "No X-API-KEY"}, 401
     
     x_api_key = request.headers.get('X-API-KEY')
-    if x_api_key != API_KEY:
+    if x_api_key != live_secret('API_KEY'):
         logging.warning("Invalid X-API-KEY")
         return {"error": "Invalid X-API-KEY"}, 401
     else:
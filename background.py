@@ -0,0 +1,81 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+_lock = threading.Lock()
+_queue = None
+_threads = []
+_pid = None
+_unfinished = 0
+_idle = threading.Condition(_lock)
+_max_workers = 4
+
+
+def configure(max_workers):
+    """Set the pool size used when the pool is first created"""
+    global _max_workers
+    _max_workers = max_workers
+
+
+def _worker():
+    global _unfinished
+    while True:
+        fn, args, kwargs = _queue.get()
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            logging.error(f"Background task failed: {e}")
+        finally:
+            with _lock:
+                _unfinished -= 1
+                if _unfinished == 0:
+                    _idle.notify_all()
+
+
+def _start():
+    """Start the pool on first use in this process, so threads never cross a fork"""
+    global _queue, _threads, _pid, _unfinished
+    _queue = queue.SimpleQueue()
+    _pid = os.getpid()
+    _unfinished = 0
+    # Daemon threads: a task still running when drain() gives up must not keep
+    # the process alive past its shutdown budget
+    _threads = [
+        threading.Thread(target=_worker, name=f'convos-bg-{i}', daemon=True)
+        for i in range(_max_workers)
+    ]
+    for thread in _threads:
+        thread.start()
+
+
+def submit(fn, *args, **kwargs):
+    """Run fn on the background pool"""
+    global _unfinished
+    with _lock:
+        if _pid != os.getpid():
+            _start()
+        _unfinished += 1
+        _queue.put((fn, args, kwargs))
+
+
+def drain(timeout=None):
+    """Wait up to timeout seconds for queued and running tasks; return how many are abandoned.
+
+    Abandoned tasks are not cancelled. They die with the process when it exits.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with _lock:
+        if _pid != os.getpid() or _unfinished == 0:
+            return 0
+        logging.info(f"Draining {_unfinished} background tasks")
+        while _unfinished:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            _idle.wait(remaining)
+        abandoned = _unfinished
+    if abandoned:
+        logging.warning(f"Abandoning {abandoned} background tasks still queued or running at shutdown")
+    return abandoned
@@ -0,0 +1,401 @@
+"""Offline benchmark for the conversations API.
+
+Boots the service against a throwaway SQLite database (or --database-url),
+with secrets supplied through GNOSIS_CONVOS_* env vars and fake profiles,
+content-processor and influencer servers answering with a configurable
+latency. Seeds users with conversations and messages, load-tests
+list/get/reply/batch/shuffle and writes p50/p95/p99 and throughput to a
+JSON file. --server picks the debug dev server (python app.py) or gunicorn.
+
+    python benchmark.py --output bench_results.json
+    python benchmark.py --compare bench_results.json
+    python benchmark.py --server dev --output dev.json
+    python benchmark.py --server gunicorn --compare dev.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+API_KEY = 'bench-key'
+SCENARIOS = ('list', 'get', 'reply', 'batch', 'shuffle')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    """Answers the downstream endpoints app.py calls, after a fixed delay"""
+    latency = 0.0
+    content_per_user = 5
+    chunks_per_content = 10
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        url = urlparse(self.path)
+
+        match = re.fullmatch(r'/api/ais/content/(\d+)', url.path)
+        if match:
+            content_id = int(match.group(1))
+            return self._reply(200, {'name': f'ai-{content_id}', 'display_name': f'AI {content_id}'})
+
+        if url.path == '/api/content_ids':
+            user_id = int(parse_qs(url.query).get('user_id', ['0'])[0])
+            base = user_id * self.content_per_user
+            return self._reply(200, {'content_ids': list(range(base, base + self.content_per_user))})
+
+        match = re.fullmatch(r'/api/content/(\d+)/chunks', url.path)
+        if match:
+            content_id = int(match.group(1))
+            base = content_id * 1000
+            return self._reply(200, {'chunks': [{'id': base + i} for i in range(self.chunks_per_content)]})
+
+        self._reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        time.sleep(self.latency)
+        if self.path == '/api/message/ai':
+            with self.lock:
+                self.answered.add(body.get('conversation_id'))
+            return self._reply(202, {'message': 'queued'})
+        self._reply(404, {'error': 'not found'})
+
+
+def start_fake_service(name, latency):
+    handler = type(f'{name}Handler', (FakeServiceHandler,), {
+        'latency': latency,
+        'answered': set(),  # conversation ids the influencer was nudged for
+        'lock': threading.Lock(),
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', free_port()), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def set_secrets(values):
+    """Provide every required secret as an env var, so app.py never calls AWS"""
+    for key, value in values.items():
+        os.environ[f"GNOSIS_CONVOS_{key}"] = str(value)
+
+
+def start_server(mode, port, workdir, workers=None):
+    """Run the service in its own process group, logging to the work directory"""
+    if mode == 'dev':
+        command = [sys.executable, 'app.py']
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:create_app()']
+    env = dict(os.environ, GNOSIS_CONVOS_PORT=str(port))
+    if workers:
+        env['WEB_CONCURRENCY'] = str(workers)
+    log = open(os.path.join(workdir, f"{mode}-server.log"), 'w')
+    return subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                            stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+
+def wait_until_ready(base_url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/metrics", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Server did not start in time")
+
+
+def stop_server(process, timeout):
+    """SIGTERM the whole process group and give it time to drain background work"""
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def seed(app_module, users, convos_per_user, messages_per_convo):
+    """Create tables and fill them with realistic-looking conversations"""
+    app, db = app_module.app, app_module.db
+    Conversation, Message, SenderType = app_module.Conversation, app_module.Message, app_module.SenderType
+    rng = random.Random(42)
+    now = datetime.utcnow()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for user_id in range(1, users + 1):
+            conversations = []
+            for i in range(convos_per_user):
+                started = now - timedelta(hours=rng.randint(0, 24 * 30))
+                conversations.append(Conversation(
+                    user_id=user_id,
+                    content_id=user_id * 5 + i % 5,
+                    start_date=started,
+                    last_update=started,
+                    score=rng.random()
+                ))
+            db.session.add_all(conversations)
+            db.session.flush()
+
+            messages = []
+            for conv in conversations:
+                for j in range(messages_per_convo):
+                    messages.append(Message(
+                        conversation_id=conv.id,
+                        sender=SenderType.ai if j % 2 == 0 else SenderType.user,
+                        message_text='lorem ipsum ' * rng.randint(5, 40),
+                        timestamp=conv.start_date + timedelta(minutes=j)
+                    ))
+            db.session.add_all(messages)
+            db.session.commit()
+
+        return [c.id for c in Conversation.query.with_entities(Conversation.id).all()]
+
+
+class BatchTracker:
+    """Tells when the background work behind a batch request has finished.
+
+    Each batch request uses a fresh user, so it is done once that user has a
+    conversation and the fake influencer has been nudged for all of them.
+    """
+
+    def __init__(self, app_module, influencer, first_user_id, timeout):
+        self.app_module = app_module
+        self.answered = influencer.RequestHandlerClass.answered
+        self.timeout = timeout
+        self._user_ids = itertools.count(first_user_id)
+        self._lock = threading.Lock()
+
+    def next_user(self):
+        with self._lock:
+            return next(self._user_ids)
+
+    def done(self, user_id):
+        Conversation = self.app_module.Conversation
+        with self.app_module.app.app_context():
+            ids = [c.id for c in Conversation.query.with_entities(Conversation.id).filter_by(user_id=user_id)]
+        return bool(ids) and all(conv_id in self.answered for conv_id in ids)
+
+    def wait(self, user_id):
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            if self.done(user_id):
+                return True
+            time.sleep(0.01)
+        return False
+
+
+def build_request(scenario, base_url, rng, users, conversation_ids, batch_tracker=None):
+    """Return (method, url, kwargs, user id whose batch to wait for or None)"""
+    user_id = rng.randint(1, users)
+    if scenario == 'list':
+        return 'GET', f"{base_url}/api/convos", {'params': {'user_id': user_id, 'limit': 20}}, None
+    if scenario == 'get':
+        return 'GET', f"{base_url}/api/convos/{rng.choice(conversation_ids)}", {}, None
+    if scenario == 'reply':
+        conv_id = rng.choice(conversation_ids)
+        return 'PUT', f"{base_url}/api/convos/{conv_id}/reply", {'json': {'message': 'benchmark reply'}}, None
+    if scenario == 'batch':
+        # Timed until the background conversation creation has finished
+        batch_user = batch_tracker.next_user()
+        return 'POST', f"{base_url}/api/convos/batch", {'json': {'user_id': batch_user, 'num_convos': 1}}, batch_user
+    if scenario == 'shuffle':
+        # /shuffle only acknowledges; the helper runs shuffle_scores synchronously
+        return 'POST', f"{base_url}/api/convos/shuffle-helper", {'json': {'user_id': user_id, 'volatility': 0.5}}, None
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def has_error_body(response):
+    """The API reports failures as {"error": ...}; count those even on a 2xx"""
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    return isinstance(body, dict) and 'error' in body
+
+
+def run_scenario(scenario, base_url, requests_count, concurrency, users, conversation_ids, batch_tracker):
+    """Fire requests_count requests with the given concurrency and summarize latencies"""
+    rng = random.Random(scenario)
+    plans = [build_request(scenario, base_url, rng, users, conversation_ids, batch_tracker)
+             for _ in range(requests_count)]
+    local = threading.local()
+
+    def call(plan):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+            local.session.headers['X-API-KEY'] = API_KEY
+        method, url, kwargs, batch_user = plan
+        start = time.perf_counter()
+        response = local.session.request(method, url, **kwargs)
+        failed = response.status_code >= 400 or has_error_body(response)
+        if batch_user is not None and not failed:
+            failed = not batch_tracker.wait(batch_user)
+        return time.perf_counter() - start, failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, plans))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed for elapsed, _ in results)
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'requests': requests_count,
+        'concurrency': concurrency,
+        'errors': sum(1 for _, failed in results if failed),
+        'throughput_rps': round(requests_count / wall, 2),
+        'p50_ms': round(cuts[49] * 1000, 2),
+        'p95_ms': round(cuts[94] * 1000, 2),
+        'p99_ms': round(cuts[98] * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2),
+    }
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)['scenarios']
+    print(f"\n{'scenario':<10}{'metric':<16}{'baseline':>12}{'current':>12}{'change':>10}")
+    for scenario, stats in current.items():
+        if scenario not in baseline:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            before, after = baseline[scenario][metric], stats[metric]
+            change = (after - before) / before * 100 if before else 0.0
+            print(f"{scenario:<10}{metric:<16}{before:>12}{after:>12}{change:>9.1f}%")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma separated subset of scenarios')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario (at least 2)')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--convos-per-user', type=int, default=50)
+    parser.add_argument('--messages-per-convo', type=int, default=12)
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='Default latency of the fake downstreams')
+    parser.add_argument('--profiles-latency-ms', type=float)
+    parser.add_argument('--content-latency-ms', type=float)
+    parser.add_argument('--influencer-latency-ms', type=float)
+    parser.add_argument('--server', choices=('dev', 'gunicorn'), default='gunicorn',
+                        help='dev runs python app.py, gunicorn runs the production config')
+    parser.add_argument('--workers', type=int, help='gunicorn workers, defaults to gunicorn.conf.py sizing')
+    parser.add_argument('--batch-timeout', type=float, default=30.0,
+                        help='A batch request counts as an error if its conversation is not created in time')
+    parser.add_argument('--drain-seconds', type=float, default=60.0,
+                        help='How long the server may take to finish background work on shutdown')
+    parser.add_argument('--database-url', help='Defaults to a temporary SQLite file. All tables are dropped!')
+    parser.add_argument('--i-know-this-drops-tables', dest='allow_drop', action='store_true',
+                        help='Required with a non-SQLite --database-url')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='Previous results file to diff against')
+    args = parser.parse_args()
+    if args.requests < 2:
+        parser.error('--requests must be at least 2 to compute percentiles')
+    if args.database_url and not args.database_url.startswith('sqlite') and not args.allow_drop:
+        parser.error('seeding drops every table in --database-url; '
+                     'pass --i-know-this-drops-tables to use a non-SQLite database')
+    return args
+
+
+def main():
+    args = parse_args()
+    scenarios = [s for s in args.scenarios.split(',') if s]
+
+    def latency(value):
+        return (args.latency_ms if value is None else value) / 1000
+
+    profiles = start_fake_service('Profiles', latency(args.profiles_latency_ms))
+    content = start_fake_service('ContentProcessor', latency(args.content_latency_ms))
+    influencer = start_fake_service('Influencer', latency(args.influencer_latency_ms))
+
+    workdir = tempfile.mkdtemp(prefix='convos-bench-')
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    set_secrets({
+        'API_KEY': API_KEY,
+        'DATABASE_URL': args.database_url or f"sqlite:///{os.path.join(workdir, 'convos.db')}",
+        'PROFILES_API_URL': f"http://127.0.0.1:{profiles.server_port}",
+        'CONTENT_PROCESSOR_API_URL': f"http://127.0.0.1:{content.server_port}",
+        'INFLUENCER_API_URL': f"http://127.0.0.1:{influencer.server_port}",
+        'CONVERSATION_API_URL': base_url,
+        'LOG_LEVEL': 'WARNING',
+        'LOG_SAMPLE_RATE': 0,
+    })
+
+    import app as app_module
+
+    print(f"Seeding {args.users} users x {args.convos_per_user} conversations "
+          f"x {args.messages_per_convo} messages...")
+    conversation_ids = seed(app_module, args.users, args.convos_per_user, args.messages_per_convo)
+    batch_tracker = BatchTracker(app_module, influencer, first_user_id=args.users + 1,
+                                 timeout=args.batch_timeout)
+
+    server = start_server(args.server, port, workdir, args.workers)
+    results = {}
+    try:
+        wait_until_ready(base_url, server)
+        for scenario in scenarios:
+            stats = run_scenario(scenario, base_url, args.requests, args.concurrency,
+                                 args.users, conversation_ids, batch_tracker)
+            results[scenario] = stats
+            print(f"{scenario:<8} p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms "
+                  f"p99={stats['p99_ms']}ms {stats['throughput_rps']} req/s errors={stats['errors']}")
+    finally:
+        stop_server(server, args.drain_seconds)
+        for fake in (profiles, content, influencer):
+            fake.shutdown()
+
+    report = {
+        'timestamp': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': vars(args),
+        'scenarios': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}, server log in {workdir}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
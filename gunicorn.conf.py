@@ -0,0 +1,107 @@
+import glob
+import math
+import os
+import shutil
+import tempfile
+import time
+
+bind = f"0.0.0.0:{os.environ.get('GNOSIS_CONVOS_PORT', 5000)}"
+
+
+def available_cpus():
+    """CPUs this process may use: the affinity mask, narrowed by a cgroup v2 CPU quota"""
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        # macOS has no affinity API
+        cpus = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+# Requests mostly wait on MySQL and the other services, so use several
+# threads per process. Set GUNICORN_WORKER_CLASS=gevent (and install gevent)
+# to use greenlets instead. Every worker has its own SQLAlchemy pool, so the
+# worker count is capped to keep MySQL connections bounded.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+max_workers = int(os.environ.get('GUNICORN_MAX_WORKERS', 9))
+workers = int(os.environ.get('WEB_CONCURRENCY', min(available_cpus() * 2 + 1, max_workers)))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Don't preload: app.py's import-time setup (secrets, engine, log listener
+# thread) runs once in each worker instead of being forked from the master.
+preload_app = False
+
+timeout = 60
+keepalive = 5
+
+# The master SIGKILLs a worker graceful_timeout seconds after SIGTERM. Within
+# that budget the worker first waits for in-flight requests (gunicorn gives
+# them up to the whole budget), then drains the background pool for at most
+# BACKGROUND_DRAIN_TIMEOUT or whatever is left, then flushes its log queue.
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+background_drain_timeout = int(os.environ.get('BACKGROUND_DRAIN_TIMEOUT', 20))
+shutdown_margin = 2
+
+# app.py writes its own access line per request
+accesslog = None
+errorlog = '-'
+
+# Workers write metrics to a shared directory so /metrics aggregates all of
+# them. It has to be set before any worker imports prometheus_client.
+owns_metrics_dir = 'PROMETHEUS_MULTIPROC_DIR' not in os.environ
+if owns_metrics_dir:
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='convos-metrics-')
+
+
+def on_starting(server):
+    """Start from empty metric files so counters from a previous run don't leak in"""
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, '*.db')):
+        os.remove(path)
+
+
+def on_exit(server):
+    if owns_metrics_dir:
+        shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    """Remember when SIGTERM arrived so worker_exit knows how much budget is left.
+
+    Runs before the worker installs its signal handlers, so gunicorn registers
+    the wrapper with its usual flags.
+    """
+    handle_exit = worker.handle_exit
+
+    def timed_handle_exit(sig, frame):
+        if not hasattr(worker, 'exit_started'):
+            worker.exit_started = time.monotonic()
+        handle_exit(sig, frame)
+
+    worker.handle_exit = timed_handle_exit
+
+
+def worker_exit(server, worker):
+    """Let queued batch/shuffle work finish, within what is left of the budget"""
+    import background
+    import request_logging
+
+    timeout = background_drain_timeout
+    if hasattr(worker, 'exit_started'):
+        remaining = graceful_timeout - shutdown_margin - (time.monotonic() - worker.exit_started)
+        timeout = max(0, min(timeout, remaining))
+    background.drain(timeout=timeout)
+    request_logging.stop_logging()
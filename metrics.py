@@ -0,0 +1,128 @@
+import os
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, disable_created_metrics,
+    generate_latest, multiprocess
+)
+from sqlalchemy import event
+
+# Upper bounds (seconds) for the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS_PATH = '/metrics'
+
+disable_created_metrics()
+
+REQUEST_LATENCY = Histogram(
+    'convos_request_duration_seconds', 'Request latency by route.',
+    ['route', 'method', 'status'], buckets=LATENCY_BUCKETS
+)
+DB_QUERIES = Counter('convos_db_queries_total', 'SQL statements executed by route.', ['route'])
+DB_QUERY_SECONDS = Counter('convos_db_query_seconds_total', 'Time spent in SQL statements by route.', ['route'])
+DOWNSTREAM_LATENCY = Histogram(
+    'convos_downstream_duration_seconds', 'Outbound HTTP latency by route and downstream service.',
+    ['route', 'downstream'], buckets=LATENCY_BUCKETS
+)
+
+
+def _current_route():
+    """Route template for the current request, so ids don't blow up label cardinality"""
+    if not has_request_context():
+        return None
+    if request.url_rule is not None:
+        return request.url_rule.rule
+    return 'unmatched'
+
+
+def _timings():
+    """Per-request accumulator for Server-Timing, or None outside a request"""
+    if not has_request_context():
+        return None
+    if 'metrics_timings' not in g:
+        g.metrics_timings = {}
+    return g.metrics_timings
+
+
+def _add_timing(name, seconds):
+    timings = _timings()
+    if timings is None:
+        return
+    count, total = timings.get(name, (0, 0.0))
+    timings[name] = (count + 1, total + seconds)
+
+
+@contextmanager
+def downstream(name):
+    """Time an outbound HTTP call to the named downstream service"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        DOWNSTREAM_LATENCY.labels(route=_current_route() or 'background', downstream=name).observe(elapsed)
+        _add_timing(name, elapsed)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    route = _current_route() or 'background'
+    DB_QUERIES.labels(route=route).inc()
+    DB_QUERY_SECONDS.labels(route=route).inc(elapsed)
+    _add_timing('db', elapsed)
+
+
+def instrument_engine(engine):
+    """Count and time every SQL statement run through the engine"""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _start_timer():
+    g.metrics_start = time.perf_counter()
+
+
+def _record_request(response):
+    start = g.pop('metrics_start', None)
+    if start is None or request.path == METRICS_PATH:
+        return response
+
+    elapsed = time.perf_counter() - start
+    REQUEST_LATENCY.labels(
+        route=_current_route(), method=request.method, status=str(response.status_code)
+    ).observe(elapsed)
+
+    parts = [f"app;dur={elapsed * 1000:.1f}"]
+    for name, (count, total) in _timings().items():
+        parts.append(f'{name};dur={total * 1000:.1f};desc="{count} calls"')
+    response.headers['Server-Timing'] = ', '.join(parts)
+    return response
+
+
+def render():
+    """Render metrics in the Prometheus text format, summed over all workers under gunicorn"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def init_app(app, engine):
+    """Register request timing hooks, SQL instrumentation and the /metrics endpoint"""
+    instrument_engine(engine)
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+
+    @app.route(METRICS_PATH)
+    def metrics_endpoint():
+        return app.response_class(render(), content_type=CONTENT_TYPE_LATEST)
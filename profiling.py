@@ -0,0 +1,92 @@
+import cProfile
+import hmac
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from werkzeug.exceptions import HTTPException
+
+PROFILE_HEADER = 'X-Profile-Token'
+
+_unsafe_chars = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def _slug(value):
+    """Make a value safe to use as part of a file name"""
+    return _unsafe_chars.sub('_', value).strip('_.')[:64] or 'none'
+
+
+class ProfilerMiddleware:
+    """WSGI middleware that runs selected requests under cProfile and dumps pstats files"""
+
+    def __init__(self, app, profile_dir, token=None, sample_rate=0.0):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self.profile_dir = profile_dir
+        self.token = token
+        self.sample_rate = sample_rate
+        # cProfile can't nest, so only one request is profiled at a time
+        self._lock = threading.Lock()
+        os.makedirs(profile_dir, exist_ok=True)
+
+    def _requested(self, environ):
+        supplied = environ.get('HTTP_' + PROFILE_HEADER.upper().replace('-', '_'))
+        if supplied and self.token:
+            return hmac.compare_digest(supplied.encode(), self.token.encode())
+        return random.random() < self.sample_rate
+
+    def _route(self, environ):
+        try:
+            rule, _ = self.app.url_map.bind_to_environ(environ).match(return_rule=True)
+            return rule.rule
+        except HTTPException:
+            return environ.get('PATH_INFO', '')
+
+    def _filename(self, environ):
+        route = _slug(self._route(environ).replace('/', '.'))
+        method = environ.get('REQUEST_METHOD', 'GET')
+        correlation_id = _slug(environ.get('HTTP_X_CORRELATION_ID', ''))
+        # pid and a random suffix keep names unique across workers sharing profile_dir
+        return f"{method}.{route}.{correlation_id}.{int(time.time() * 1000)}.{os.getpid()}.{os.urandom(3).hex()}.prof"
+
+    def __call__(self, environ, start_response):
+        if not self._requested(environ) or not self._lock.acquire(blocking=False):
+            return self.wsgi_app(environ, start_response)
+
+        filename = self._filename(environ)
+
+        def profiled_start_response(status, headers, exc_info=None):
+            headers.append(('X-Profile-File', filename))
+            return start_response(status, headers, exc_info)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            response = self.wsgi_app(environ, profiled_start_response)
+            try:
+                # Drain the body inside the profiler so serialization is included
+                body = list(response)
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+        finally:
+            profiler.disable()
+            self._lock.release()
+
+        path = os.path.join(self.profile_dir, filename)
+        try:
+            profiler.dump_stats(path)
+            logging.info(f"Wrote request profile to {path}")
+        except OSError as e:
+            logging.error(f"Error writing request profile: {e}")
+        return body
+
+
+def init_app(app, profile_dir, token=None, sample_rate=0.0):
+    """Install the profiler only when a token or sample rate is configured"""
+    if not token and sample_rate <= 0:
+        return
+    app.wsgi_app = ProfilerMiddleware(app, profile_dir, token=token, sample_rate=sample_rate)
@@ -0,0 +1,107 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, request
+
+from profiling import PROFILE_HEADER
+
+# Headers whose values must never reach the logs
+REDACTED_HEADERS = {'x-api-key', 'authorization', 'cookie', 'set-cookie', PROFILE_HEADER.lower()}
+
+access_logger = logging.getLogger('convos.access')
+
+_listener = None
+
+
+def configure_logging(level=logging.INFO, fmt='%(asctime)s - %(levelname)s - %(message)s',
+                      datefmt='%Y-%m-%d %H:%M:%S'):
+    """Route root logging through a queue so request threads never block on log I/O"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(fmt, datefmt=datefmt))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the background listener"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def redact_headers(headers):
+    """Render headers on one line with secrets masked"""
+    return ', '.join(
+        f"{name}: {'<redacted>' if name.lower() in REDACTED_HEADERS else value}"
+        for name, value in headers.items()
+    )
+
+
+def truncate(data, max_bytes):
+    """Shorten a body for logging, noting how much was dropped"""
+    if len(data) <= max_bytes:
+        return data
+    return data[:max_bytes] + f"... <{len(data) - max_bytes} more bytes>".encode()
+
+
+def format_fields(fields):
+    """Render fields as key=value pairs, quoting values that contain spaces, quotes or '='"""
+    parts = []
+    for key, value in fields.items():
+        value = '-' if value is None else str(value)
+        if not value or any(c in value for c in ' "='):
+            value = json.dumps(value)
+        parts.append(f"{key}={value}")
+    return ' '.join(parts)
+
+
+def init_app(app, sample_rate=0.01, body_max_bytes=256, skip_paths=()):
+    """Emit one access line per request and sampled, redacted request details"""
+    # Our access line replaces the dev server's own per-request log line
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    def skipped():
+        return any(request.path.startswith(path) for path in skip_paths)
+
+    @app.before_request
+    def start_request_log():
+        g.log_start = time.perf_counter()
+        if skipped() or random.random() >= sample_rate:
+            return
+        logging.info(f"Headers: {redact_headers(request.headers)}")
+        if body_max_bytes > 0:
+            logging.info(f"Body: {truncate(request.get_data(), body_max_bytes)}")
+
+    @app.after_request
+    def log_access(response):
+        start = g.pop('log_start', None)
+        if start is None or skipped() or not access_logger.isEnabledFor(logging.INFO):
+            return response
+        fields = {
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - start) * 1000, 1),
+            'bytes': response.calculate_content_length(),
+            'cid': request.headers.get('X-Correlation-ID'),
+        }
+        access_logger.info(format_fields(fields), extra={'access': fields})
+        return response
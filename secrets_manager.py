@@ -1,23 +1,219 @@
-import boto3
+import fcntl
 import json
+import logging
 import os
-from botocore.exceptions import ClientError
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Local cache shared by every worker/process of this user on the host
+CACHE_DIR = os.environ.get(
+    'GNOSIS_SECRETS_CACHE_DIR',
+    os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'gnosis-secrets')
+)
+# Serve the cache without refreshing for this long
+CACHE_TTL = float(os.environ.get('GNOSIS_SECRETS_TTL', 300))
+# Past the TTL a stale cache is still served while it refreshes in the background, up to this age
+CACHE_MAX_STALE = float(os.environ.get('GNOSIS_SECRETS_MAX_STALE', 24 * 3600))
+# Loading secrets should not take longer than this at startup
+STARTUP_BUDGET = float(os.environ.get('GNOSIS_SECRETS_STARTUP_BUDGET', 1.0))
+
+# service name -> (secrets, time.monotonic() when loaded)
+_memory_cache = {}
+
+
+def get_secrets(secret_name="gnosis-secrets", region_name="us-east-1"):
+    # boto3 is slow to import, only pay for it when we actually go to AWS
+    import boto3
+    from botocore.config import Config
 
-def get_secrets(secret_name="gnosis-secrets", region_name="us-east-1"):        
     session = boto3.session.Session()
     client = session.client(
         service_name='secretsmanager',
-        region_name=region_name
+        region_name=region_name,
+        config=Config(connect_timeout=2, read_timeout=2, retries={'max_attempts': 2})
+    )
+
+    get_secret_value_response = client.get_secret_value(
+        SecretId=secret_name
     )
+    return json.loads(get_secret_value_response['SecretString'])
+
+
+def _env_prefix(service_name):
+    return service_name.upper().replace('-', '_') + '_'
+
+
+def _env_secrets(service_name):
+    """Secrets set as <SERVICE>_<KEY> env vars, e.g. GNOSIS_CONVOS_API_KEY"""
+    prefix = _env_prefix(service_name)
+    return {key[len(prefix):]: value for key, value in os.environ.items() if key.startswith(prefix)}
+
+
+def _complete(secrets, env, required):
+    """Whether secrets (plus env overrides) hold every required key"""
+    return bool(secrets) and all(key in secrets or key in env for key in required)
+
+
+def _is_private(st):
+    """Owned by us with no group/other permission bits"""
+    return st.st_uid == os.getuid() and not st.st_mode & 0o077
+
+
+def _cache_dir_ok():
+    """Create the cache dir if needed and check nobody else can plant files in it"""
+    try:
+        os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+        if _is_private(os.stat(CACHE_DIR)):
+            return True
+    except OSError as e:
+        logging.warning(f"Secrets cache unavailable: {e}")
+        return False
+    logging.warning(f"Ignoring secrets cache {CACHE_DIR}: not owned by this user or not mode 0700")
+    return False
+
+
+def _cache_path(service_name):
+    return os.path.join(CACHE_DIR, f"{service_name}.json")
+
+
+def _read_cache(service_name):
+    """Return (secrets, age in seconds) from the local cache, or (None, None)"""
+    path = _cache_path(service_name)
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return None, None
+    with os.fdopen(fd) as f:
+        st = os.fstat(f.fileno())
+        if not _is_private(st):
+            logging.warning(f"Ignoring secrets cache {path}: not owned by this user or not mode 0600")
+            return None, None
+        try:
+            secrets = json.load(f)
+        except ValueError:
+            return None, None
+    if not isinstance(secrets, dict):
+        return None, None
+    return secrets, time.time() - st.st_mtime
+
 
+def _write_cache(service_name, secrets):
+    """Atomically write the cache, readable by the current user only"""
     try:
-        get_secret_value_response = client.get_secret_value(
-            SecretId=secret_name
-        )
-        return json.loads(get_secret_value_response['SecretString'])
-    except ClientError as e:
-        raise e
-
-def get_service_secrets(service_name):
-    secrets = get_secrets()
-    return secrets.get(service_name, {})
\ No newline at end of file
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, prefix=f".{service_name}.")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(secrets, f)
+        os.replace(tmp_path, _cache_path(service_name))
+    except OSError as e:
+        logging.warning(f"Could not write secrets cache: {e}")
+
+
+@contextmanager
+def _cache_lock(service_name, blocking=True):
+    """Cross-process lock so only one worker talks to Secrets Manager; yields False if busy"""
+    fd = os.open(os.path.join(CACHE_DIR, f".{service_name}.lock"), os.O_WRONLY | os.O_CREAT, 0o600)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        os.close(fd)
+
+
+def _fetch(service_name, env, required, write_cache):
+    secrets = get_secrets().get(service_name, {})
+    if not _complete(secrets, env, required):
+        missing = [key for key in required if key not in secrets and key not in env]
+        raise ValueError(f"Secrets for {service_name} are empty or missing {missing}")
+    if write_cache:
+        _write_cache(service_name, secrets)
+    return secrets
+
+
+def _refresh_in_background(service_name, env, required):
+    """Refresh a stale cache from one process at a time, without blocking the caller"""
+    def refresh():
+        try:
+            with _cache_lock(service_name, blocking=False) as locked:
+                if locked:
+                    secrets = _fetch(service_name, env, required, write_cache=True)
+                    _memory_cache[service_name] = ({**secrets, **env}, time.monotonic())
+        except Exception as e:
+            logging.warning(f"Background secrets refresh failed: {e}")
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def _read_valid_cache(service_name, env, required):
+    cached, age = _read_cache(service_name)
+    if cached is not None and not _complete(cached, env, required):
+        logging.warning(f"Ignoring incomplete secrets cache for {service_name}")
+        return None, None
+    return cached, age
+
+
+def _load(service_name, required):
+    env = _env_secrets(service_name)
+    if required and all(key in env for key in required):
+        return env, 'env'
+
+    if not _cache_dir_ok():
+        return {**_fetch(service_name, env, required, write_cache=False), **env}, 'secrets manager'
+
+    cached, age = _read_valid_cache(service_name, env, required)
+    if cached is not None and age < CACHE_TTL:
+        return {**cached, **env}, 'cache'
+    if cached is not None and age < CACHE_MAX_STALE:
+        _refresh_in_background(service_name, env, required)
+        return {**cached, **env}, 'stale cache'
+
+    # Cold cache: one worker fetches, the others wait and pick up its result
+    with _cache_lock(service_name):
+        cached, age = _read_valid_cache(service_name, env, required)
+        if cached is not None and age < CACHE_TTL:
+            return {**cached, **env}, 'cache'
+        try:
+            return {**_fetch(service_name, env, required, write_cache=True), **env}, 'secrets manager'
+        except Exception as e:
+            if cached is None:
+                raise
+            logging.warning(f"Secrets Manager unavailable, using expired cache: {e}")
+            return {**cached, **env}, 'expired cache'
+
+
+def get_service_secrets(service_name, required=()):
+    """Secrets for a service: env vars, then the local TTL cache, then Secrets Manager.
+
+    If every key in `required` is set in the environment, no cache or network
+    access happens at all. A cache or Secrets Manager result missing any
+    required key is rejected.
+
+    Results are kept in memory for GNOSIS_SECRETS_TTL seconds; after that the
+    next call reloads them, so callers that read through this function on each
+    use pick up rotated secrets without a restart.
+    """
+    entry = _memory_cache.get(service_name)
+    if entry is not None and time.monotonic() - entry[1] < CACHE_TTL:
+        return entry[0]
+
+    start = time.perf_counter()
+    try:
+        secrets, source = _load(service_name, required)
+    except Exception as e:
+        if entry is None:
+            raise
+        logging.warning(f"Could not reload {service_name} secrets, keeping the current ones: {e}")
+        _memory_cache[service_name] = (entry[0], time.monotonic())
+        return entry[0]
+    elapsed = time.perf_counter() - start
+
+    _memory_cache[service_name] = (secrets, time.monotonic())
+    logging.info(f"Loaded {service_name} secrets from {source} in {elapsed * 1000:.1f}ms")
+    if elapsed > STARTUP_BUDGET:
+        logging.warning(f"Loading secrets took {elapsed:.2f}s, over the {STARTUP_BUDGET:.2f}s startup budget")
+    return secrets
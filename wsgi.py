@@ -0,0 +1,8 @@
+"""Production entry point: gunicorn -c gunicorn.conf.py 'wsgi:create_app()'"""
+
+
+def create_app():
+    """Import the app inside the worker so secrets, engine and log thread are set up per process"""
+    from app import app
+    app.config['DEBUG'] = False
+    return app